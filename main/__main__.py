@@ -1,14 +1,17 @@
 import asyncio
+import hmac
 import json
 import logging
 import os
 from argparse import ArgumentParser
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Annotated, cast
+from typing import Annotated, Any, AsyncIterator, cast
 
+import msgspec
 import uvicorn
-from fastapi import Body, FastAPI, Header, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, status
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
@@ -17,50 +20,91 @@ logger = logging.getLogger(__name__)
 
 from .event import Database, handle_event
 
+# How long to wait after a change before writing the database to disk, so that
+# a burst of webhooks results in a single save.
+SAVE_DELAY_SECONDS = 5.0
+
+EVENT_DECODER = msgspec.json.Decoder(dict[str, Any])
+
 
 def make_app(*, auth_token: str, data_dir: Path, mailgun_api_key: str):
-    app = FastAPI()
+    # The in-memory database is authoritative; the data directory is only used
+    # to persist it across restarts.
+    database = Database({}, {}, {})
+    database_lock = asyncio.Lock()
+    dirty = False
+    flush_task: asyncio.Task | None = None
+
+    async def flush() -> None:
+        nonlocal dirty
+        async with database_lock:
+            if not dirty:
+                return
+            try:
+                await database.save(data_dir)
+            except Exception:
+                logger.error("Failed to save database", exc_info=True)
+                return
+            dirty = False
+
+    async def debounced_flush() -> None:
+        nonlocal flush_task
+        await asyncio.sleep(SAVE_DELAY_SECONDS)
+        flush_task = None
+        await flush()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        nonlocal database
+        database = Database.load(data_dir)
+        yield
+        if flush_task is not None:
+            flush_task.cancel()
+        await flush()
 
-    @app.get("/cvent-event")
-    async def auth(
-        authorization: Annotated[str | None, Header()] = None,
-    ):
-        if authorization != auth_token:
-            logger.warning("Incorrect auth: {authorization!r}")
-            raise HTTPException(
-                status_code=401, detail=f"Incorrect authorization: {authorization!r}"
-            )
-        return {"message": "Correct auth!"}
+    app = FastAPI(lifespan=lifespan)
 
-    @app.post("/cvent-event")
-    async def cvent_event(
-        event: Annotated[dict, Body()],
+    async def require_auth(
         authorization: Annotated[str | None, Header()] = None,
-    ):
-        if authorization != auth_token:
-            logger.warning("Incorrect auth: {authorization!r}")
+    ) -> None:
+        if not hmac.compare_digest((authorization or "").encode(), auth_token.encode()):
+            logger.warning("Incorrect auth: %r", authorization)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail=f"Incorrect auth: {authorization!r}",
             )
-        database = Database.load(data_dir)
+
+    @app.get("/cvent-event", dependencies=[Depends(require_auth)])
+    async def auth():
+        return {"message": "Correct auth!"}
+
+    @app.post("/cvent-event", dependencies=[Depends(require_auth)])
+    async def cvent_event(request: Request):
+        nonlocal dirty, flush_task
         try:
-            changed = handle_event(event, database, mailgun_api_key)
-        except Exception as e:
-            logger.warning("Failed to process request", exc_info=True)
-            for line in json.dumps(event, indent=4).splitlines():
-                logger.debug("event: %s", line)
+            event = EVENT_DECODER.decode(await request.body())
+        except msgspec.DecodeError as e:
+            logger.warning("Failed to decode request body", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"{type(e).__name__}: {e}",
             )
-        if not changed:
-            return
-        try:
-            database.save(data_dir)
-        except Exception:
-            logger.error("Failed to save database", exc_info=True)
-            return
+        async with database_lock:
+            try:
+                changed = handle_event(event, database, mailgun_api_key)
+            except Exception as e:
+                logger.warning("Failed to process request", exc_info=True)
+                for line in json.dumps(event, indent=4).splitlines():
+                    logger.debug("event: %s", line)
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"{type(e).__name__}: {e}",
+                )
+            if not changed:
+                return
+            dirty = True
+        if flush_task is None:
+            flush_task = asyncio.create_task(debounced_flush())
 
     return app
 
@@ -99,4 +143,5 @@ if __name__ == "__main__":
             mailgun_api_key=mailgun_api_key,
         ),
         port=args.port,
+        loop="uvloop",
     )
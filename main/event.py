@@ -1,26 +1,26 @@
+import asyncio
+import hashlib
 import json
 import logging
+import os
 import re
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 from datetime import date, datetime
 from enum import Enum, auto
+from functools import cached_property, lru_cache
 from pathlib import Path
 from textwrap import dedent
-from typing import Any, Self
+from typing import Any, Iterable, Iterator, Self
 
+import msgspec
 import requests
-from pydantic import BaseModel
 from requests.auth import HTTPBasicAuth
 
 logger = logging.getLogger(__name__)
 
 
-def camel_case(name: str) -> str:
-    first, *rest = name.split("_")
-    return first + "".join(map(str.capitalize, rest))
-
-
-class SessionData(BaseModel):
+class SessionData(msgspec.Struct, frozen=True, kw_only=True, rename="camel", gc=False):
     session_description: str
     session_end_date_time: datetime
     session_name: str
@@ -31,12 +31,8 @@ class SessionData(BaseModel):
     timezone_name: str
     updated_date: date
 
-    class Config:
-        alias_generator = camel_case
-        frozen = True
-
 
-class SpeakerData(BaseModel):
+class SpeakerData(msgspec.Struct, frozen=True, kw_only=True, rename="camel", gc=False):
     presenter_at: list[str] = []
     speaker_biography: str
     speaker_display_name: str
@@ -46,9 +42,10 @@ class SpeakerData(BaseModel):
     speaker_title: str
     updated_date: date
 
-    class Config:
-        alias_generator = camel_case
-        frozen = True
+
+SESSION_DECODER = msgspec.json.Decoder(SessionData)
+SPEAKER_DECODER = msgspec.json.Decoder(SpeakerData)
+ENCODER = msgspec.json.Encoder()
 
 
 class SpeakerCategory(Enum):
@@ -65,6 +62,23 @@ class Session:
     data: SessionData
     updated: bool = True
     deleted: bool = False
+    checksum: bytes | None = field(default=None, compare=False, repr=False)
+    _links: dict[str, str] = field(
+        default_factory=dict, init=False, compare=False, repr=False
+    )
+
+    def update(self, data: SessionData) -> None:
+        self.data = data
+        self.updated = True
+        for name in (
+            "slugified_name",
+            "url_relpath",
+            "start_date",
+            "start_time",
+            "end_time",
+        ):
+            self.__dict__.pop(name, None)
+        self._links.clear()
 
     @property
     def filename(self) -> str:
@@ -74,24 +88,58 @@ class Session:
     def stub(self) -> str:
         return self.data.session_stub
 
-    @property
+    @cached_property
     def slugified_name(self) -> str:
         return slugify(self.data.session_name)
 
-    @property
+    @cached_property
     def url_relpath(self) -> str:
         return f"sessions/{self.slugified_name}/"
 
+    @cached_property
+    def start_date(self) -> str:
+        return self.data.session_start_date_time.strftime("%A, %B %d, %Y")
+
+    @cached_property
+    def start_time(self) -> str:
+        return self.data.session_start_date_time.strftime("%I:%M %p")
+
+    @cached_property
+    def end_time(self) -> str:
+        return self.data.session_end_date_time.strftime("%I:%M %p")
+
     def link(self, base_url: str) -> str:
-        return f'<a href="{base_url}{self.url_relpath}">{self.data.session_name}</a>'
+        if (link := self._links.get(base_url)) is None:
+            link = (
+                f'<a href="{base_url}{self.url_relpath}">{self.data.session_name}</a>'
+            )
+            self._links[base_url] = link
+        return link
 
 
 @dataclass
 class Speaker:
     data: SpeakerData
-    categories: list[SpeakerCategory]
+    categories: frozenset[SpeakerCategory]
     updated: bool = True
     deleted: bool = False
+    checksum: bytes | None = field(default=None, compare=False, repr=False)
+    _links: dict[str, str] = field(
+        default_factory=dict, init=False, compare=False, repr=False
+    )
+
+    def update(self, data: SpeakerData) -> None:
+        self.data = data
+        self.updated = True
+        self.__dict__.pop("slugified_name", None)
+        self.__dict__.pop("url_relpath", None)
+        self._links.clear()
+
+    def update_categories(self, categories: frozenset[SpeakerCategory]) -> None:
+        if categories != self.categories:
+            self.categories = categories
+            self.__dict__.pop("url_relpath", None)
+            self._links.clear()
 
     @property
     def filename(self) -> str:
@@ -101,11 +149,11 @@ class Speaker:
     def stub(self) -> str:
         return self.data.speaker_stub
 
-    @property
+    @cached_property
     def slugified_name(self) -> str:
         return slugify(self.data.speaker_display_name)
 
-    @property
+    @cached_property
     def url_relpath(self) -> str:
         if SpeakerCategory.COMPOSER in self.categories:
             return f"composers/{self.slugified_name}/"
@@ -115,21 +163,28 @@ class Speaker:
             return f"speakers/{self.slugified_name}/"
 
     def link(self, base_url: str) -> str:
-        return f'<a href="{base_url}{self.url_relpath}">{self.data.speaker_display_name}</a>'
+        if (link := self._links.get(base_url)) is None:
+            link = f'<a href="{base_url}{self.url_relpath}">{self.data.speaker_display_name}</a>'
+            self._links[base_url] = link
+        return link
 
 
 @dataclass
 class Database:
     sessions: dict[str, Session]
     speakers: dict[str, Speaker]
-    speaker_categories: dict[str, list[SpeakerCategory]]
+    speaker_categories: dict[str, frozenset[SpeakerCategory]]
 
     @classmethod
     def load(cls, data_dir: Path) -> Self:
         self = cls({}, {}, {})
         try:
-            for path in (data_dir / "sessions").iterdir():
-                session = Session(SessionData.parse_file(path), updated=False)
+            for content in read_files(data_dir / "sessions"):
+                session = Session(
+                    SESSION_DECODER.decode(content),
+                    updated=False,
+                    checksum=checksum(content),
+                )
                 if session.stub in self.sessions:
                     logger.warn(
                         "Duplicate session stub: %s (%s)",
@@ -137,41 +192,22 @@ class Database:
                         session.slugified_name,
                     )
                 self.sessions[session.stub] = session
-
-                for speaker_stub, category in zip(
-                    session.data.speakers, session.data.speaker_category
-                ):
-                    if category in {"Organist", "Performer"}:
-                        self.speaker_categories.setdefault(speaker_stub, []).append(
-                            SpeakerCategory.PERFORMER
-                        )
-                    elif category in {"New Music Composer"}:
-                        self.speaker_categories.setdefault(speaker_stub, []).append(
-                            SpeakerCategory.COMPOSER
-                        )
-                    elif category in {
-                        "Speaker",
-                        "Panelist",
-                        "Presenter",
-                        "Workshop Presenter",
-                        "Moderator",
-                    }:
-                        self.speaker_categories.setdefault(speaker_stub, []).append(
-                            SpeakerCategory.PRESENTER
-                        )
-                    else:
-                        logger.warning(
-                            "Unknown speaker category %s in %s",
-                            category,
-                            session.slugified_name,
-                        )
         except FileNotFoundError:
             logger.warn("FileNotFound while loading sessions", exc_info=True)
+        self.update_speaker_categories(
+            speaker_stub
+            for session in self.sessions.values()
+            for speaker_stub in session.data.speakers
+        )
         try:
-            for path in (data_dir / "speakers").iterdir():
-                data = SpeakerData.parse_file(path)
-                categories = self.speaker_categories.get(data.speaker_stub, [])
-                speaker = Speaker(data, categories, updated=False)
+            for content in read_files(data_dir / "speakers"):
+                data = SPEAKER_DECODER.decode(content)
+                speaker = Speaker(
+                    data,
+                    self.speaker_categories.get(data.speaker_stub, frozenset()),
+                    updated=False,
+                    checksum=checksum(content),
+                )
                 if speaker.stub in self.speakers:
                     logger.warn(
                         "Duplicate speaker stub: %s (%s)",
@@ -183,20 +219,58 @@ class Database:
             logger.warn("FileNotFound while loading speakers", exc_info=True)
         return self
 
-    def save(self, data_dir: Path) -> None:
+    def update_speaker_categories(self, speaker_stubs: Iterable[str]) -> None:
+        categories: dict[str, set[SpeakerCategory]] = {
+            speaker_stub: set() for speaker_stub in speaker_stubs
+        }
+        for session in self.sessions.values():
+            if categories.keys().isdisjoint(session.data.speakers):
+                continue
+            for speaker_stub, category in session_speaker_categories(session):
+                if speaker_stub in categories:
+                    categories[speaker_stub].add(category)
+        for speaker_stub, speaker_categories in categories.items():
+            frozen = frozenset(speaker_categories)
+            if frozen:
+                self.speaker_categories[speaker_stub] = frozen
+            else:
+                self.speaker_categories.pop(speaker_stub, None)
+            if (speaker := self.speakers.get(speaker_stub)) is not None:
+                speaker.update_categories(frozen)
+
+    async def save(self, data_dir: Path) -> None:
         data_dir.mkdir(exist_ok=True)
         (data_dir / "sessions").mkdir(exist_ok=True)
+        (data_dir / "speakers").mkdir(exist_ok=True)
+        writes: list[tuple[Session | Speaker, Path, bytes]] = []
         for session in self.sessions.values():
             if session.updated:
                 path = data_dir / "sessions" / session.filename
-                path.write_text(session.data.json(by_alias=True))
-                logger.info("Wrote %s", path)
-        (data_dir / "speakers").mkdir(exist_ok=True)
+                writes.append((session, path, ENCODER.encode(session.data)))
         for speaker in self.speakers.values():
             if speaker.updated:
                 path = data_dir / "speakers" / speaker.filename
-                path.write_text(speaker.data.json(by_alias=True))
-                logger.info("Wrote %s", path)
+                writes.append((speaker, path, ENCODER.encode(speaker.data)))
+
+        # Skip records whose serialized form matches what is already on disk
+        changed = []
+        for record, path, content in writes:
+            digest = checksum(content)
+            if digest != record.checksum:
+                changed.append((record, path, content, digest))
+            else:
+                record.updated = False
+
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(path.write_bytes, content)
+                for _, path, content, _ in changed
+            )
+        )
+        for record, path, _, digest in changed:
+            record.updated = False
+            record.checksum = digest
+            logger.info("Wrote %s", path)
 
     def delete_session(self, stub: str) -> bool:
         if (existing := self.sessions.get(stub)) is not None:
@@ -215,12 +289,14 @@ class Database:
             if existing.data == data:
                 return False
             else:
-                existing.data = data
-                existing.updated = True
+                old_speakers = existing.data.speakers
+                existing.update(data)
+                self.update_speaker_categories([*old_speakers, *data.speakers])
                 return True
         else:
             session = Session(data)
             self.sessions[session.stub] = session
+            self.update_speaker_categories(data.speakers)
             return True
 
     def update_speaker(self, data: SpeakerData) -> bool:
@@ -228,11 +304,10 @@ class Database:
             if existing.data == data:
                 return False
             else:
-                existing.data = data
-                existing.updated = True
+                existing.update(data)
                 return True
         else:
-            categories = self.speaker_categories.get(data.speaker_stub, [])
+            categories = self.speaker_categories.get(data.speaker_stub, frozenset())
             speaker = Speaker(data, categories)
             self.speakers[speaker.stub] = speaker
             return True
@@ -248,19 +323,19 @@ def handle_event(event: dict, database: Database, mailgun_api_key: str) -> bool:
 
     logger.info("Handling event of type %r", event_type)
     if event_type == "SessionCreated":
-        session = SessionData(**message)
+        session = msgspec.convert(message, SessionData)
         changed = database.update_session(session)
     elif event_type == "SessionUpdated":
-        session = SessionData(**message)
+        session = msgspec.convert(message, SessionData)
         changed = database.update_session(session)
     elif event_type == "SessionDeleted":
         session_stub = message["sessionStub"]
         changed = database.delete_session(session_stub)
     elif event_type == "SpeakerCreated":
-        speaker = SpeakerData(**message)
+        speaker = msgspec.convert(message, SpeakerData)
         changed = database.update_speaker(speaker)
     elif event_type == "SpeakerUpdated":
-        speaker = SpeakerData(**message)
+        speaker = msgspec.convert(message, SpeakerData)
         changed = database.update_speaker(speaker)
     elif event_type == "SpeakerDeleted":
         speaker_stub = message["speakerStub"]
@@ -281,6 +356,11 @@ def handle_event(event: dict, database: Database, mailgun_api_key: str) -> bool:
     return changed
 
 
+# Strong references to in-flight notification tasks, so they aren't garbage
+# collected before they finish
+background_tasks: set[asyncio.Task] = set()
+
+
 def notify_about_circle_registration(
     message: dict[str, Any], mailgun_api_key: str
 ) -> None:
@@ -305,11 +385,38 @@ def notify_about_circle_registration(
         "subject": subject,
         "text": body,
     }
-    r = requests.post(
-        "https://api.mailgun.net/v3/mg.sfago2024.org/messages",
-        data=data,
-        auth=HTTPBasicAuth("api", mailgun_api_key),
+    # Send in the background so the webhook response doesn't wait on Mailgun
+    task = asyncio.create_task(
+        asyncio.to_thread(send_mailgun_message, data, mailgun_api_key)
     )
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+# Notifications are sent from worker threads, and requests doesn't guarantee
+# that a Session is thread-safe, so keep one per thread. Each is reused across
+# notifications so the connection to Mailgun is kept alive.
+mailgun_sessions = threading.local()
+
+
+def mailgun_session() -> requests.Session:
+    try:
+        return mailgun_sessions.session
+    except AttributeError:
+        session = mailgun_sessions.session = requests.Session()
+        return session
+
+
+def send_mailgun_message(data: dict[str, str], mailgun_api_key: str) -> None:
+    try:
+        r = mailgun_session().post(
+            "https://api.mailgun.net/v3/mg.sfago2024.org/messages",
+            data=data,
+            auth=HTTPBasicAuth("api", mailgun_api_key),
+        )
+    except requests.RequestException:
+        logger.error("Mailgun request failed", exc_info=True)
+        return
     try:
         r.raise_for_status()
     except Exception:
@@ -317,8 +424,46 @@ def notify_about_circle_registration(
         logger.warning("Failed request content: %s", r.text.rstrip())
 
 
+def session_speaker_categories(
+    session: Session,
+) -> Iterator[tuple[str, SpeakerCategory]]:
+    for speaker_stub, category in zip(
+        session.data.speakers, session.data.speaker_category
+    ):
+        if category in {"Organist", "Performer"}:
+            yield speaker_stub, SpeakerCategory.PERFORMER
+        elif category in {"New Music Composer"}:
+            yield speaker_stub, SpeakerCategory.COMPOSER
+        elif category in {
+            "Speaker",
+            "Panelist",
+            "Presenter",
+            "Workshop Presenter",
+            "Moderator",
+        }:
+            yield speaker_stub, SpeakerCategory.PRESENTER
+        else:
+            logger.warning(
+                "Unknown speaker category %s in %s",
+                category,
+                session.slugified_name,
+            )
+
+
+def read_files(directory: Path) -> Iterator[bytes]:
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            with open(entry.path, "rb") as f:
+                yield f.read()
+
+
+def checksum(content: bytes) -> bytes:
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
 SLUG_REPLACE_PATTERN: re.Pattern[str] = re.compile(r"[^\w\d]+")
 
 
+@lru_cache(maxsize=4096)
 def slugify(s: str) -> str:
     return SLUG_REPLACE_PATTERN.sub("-", s.casefold()).strip("-")
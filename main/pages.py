@@ -1,8 +1,9 @@
+import asyncio
 import logging
 import shutil
 from asyncio.subprocess import PIPE, create_subprocess_exec
 from contextlib import asynccontextmanager
-from datetime import date, datetime, time
+from datetime import date, time
 from pathlib import Path
 from textwrap import dedent
 from typing import AsyncIterator
@@ -12,62 +13,87 @@ from .event import Database, Session, Speaker, SpeakerCategory
 logger = logging.getLogger(__name__)
 
 
+PAGE_TEMPLATE = dedent(
+    """\
+    +++
+    title = '''{title}'''
+    path = '''{path}'''
+    template = "future.html"
+    +++
+
+    <p class="todo">
+    <strong>NOTE:</strong> This page is automatically generated based on data from Cvent.
+    But, I'm aware of several issues with the generated pages at the moment:
+    many dates & times are wrong, and some sessions & speakers are missing altogether!
+    </p>
+
+    {content}
+    """
+)
+
+
 def render_page(path: str, title: str, content: str):
-    date = datetime.now()
-    return dedent(
-        """\
-        +++
-        title = '''{title}'''
-        path = '''{path}'''
-        template = "future.html"
-        +++
-
-        <p class="todo">
-        <strong>NOTE:</strong> This page is automatically generated based on data from Cvent.
-        But, I'm aware of several issues with the generated pages at the moment:
-        many dates & times are wrong, and some sessions & speakers are missing altogether!
-        </p>
-
-        {content}
-        """
-    ).format(**locals())
+    return PAGE_TEMPLATE.format(title=title, path=path, content=content)
+
+
+def speaker_content(speaker: Speaker, sessions: str) -> str:
+    data = speaker.data
+    return (
+        f"<h1>{data.speaker_display_name}</h1>\n"
+        "<h2>Biography</h2>\n"
+        f"<p>{data.speaker_biography}</p>\n"
+        "<h2>Sessions</h2>\n"
+        f"{sessions}\n"
+    )
 
 
 def speaker_page(path: str, speaker: Speaker, base_url: str, database: Database) -> str:
     if stubs := speaker.data.presenter_at:
-        sessions = "<ul>"
+        items = ["<ul>"]
         for stub in stubs:
             if session := database.sessions.get(stub):
-                sessions += f"<li>{session.link(base_url)}</li>"
+                items.append(f"<li>{session.link(base_url)}</li>")
             else:
-                sessions += f"<li>(unknown session with identifier {stub})</li>"
+                items.append(f"<li>(unknown session with identifier {stub})</li>")
+        items.append("</ul>")
+        sessions = "".join(items)
     else:
         sessions = "<p>None yet</p>"
-    content = dedent(
-        """\
-        <h1>{speaker.data.speaker_display_name}</h1>
-        <h2>Biography</h2>
-        <p>{speaker.data.speaker_biography}</p>
-        <h2>Sessions</h2>
-        {sessions}
-        """
-    ).format(**locals())
+    content = speaker_content(speaker, sessions)
     return render_page(
         path=path, title=f"{speaker.data.speaker_display_name}", content=content
     )
 
 
+def session_content(
+    session: Session, speaker_label: str | None, speakers: str | None
+) -> str:
+    data = session.data
+    content = (
+        f"<h1>{data.session_name}</h1>\n"
+        "<h2>Date/Time</h2>\n"
+        f"<p>{session.start_date}<br>\n"
+        f"{session.start_time} – {session.end_time} ({data.timezone_name})</p>\n"
+        "<h2>Description</h2>\n"
+        f"{data.session_description}\n"
+    )
+    if speaker_label:
+        content += f"<h2>{speaker_label}</h2>\n{speakers}\n"
+    return content
+
+
 def session_page(path: str, session: Session, base_url: str, database: Database) -> str:
     if stubs := session.data.speakers:
-        speakers = "<ul>"
-        speaker_types = set()
+        items = ["<ul>"]
+        speaker_types: set[SpeakerCategory] = set()
         for stub in stubs:
             if speaker := database.speakers.get(stub):
-                speaker_types.update(database.speaker_categories.get(speaker.stub, []))
-                speakers += f"<li>{speaker.link(base_url)}</li>"
+                speaker_types.update(speaker.categories)
+                items.append(f"<li>{speaker.link(base_url)}</li>")
             else:
-                speakers += f"<li>(unknown speaker with identifier {stub})</li>"
-        speakers += "</ul>"
+                items.append(f"<li>(unknown speaker with identifier {stub})</li>")
+        items.append("</ul>")
+        speakers = "".join(items)
         match speaker_types:
             case [SpeakerCategory.PERFORMER]:
                 speaker_label = "Performers"
@@ -78,51 +104,48 @@ def session_page(path: str, session: Session, base_url: str, database: Database)
     else:
         speaker_label = None
         speakers = None
-    content = dedent(
-        """\
-        <h1>{session.data.session_name}</h1>
-        <h2>Date/Time</h2>
-        <p>{session.data.session_start_date_time:%A, %B %d, %Y}<br>
-        {session.data.session_start_date_time:%I:%M %p} – {session.data.session_end_date_time:%I:%M %p} ({session.data.timezone_name})</p>
-        <h2>Description</h2>
-        {session.data.session_description}
-        """
-    ).format(**locals())
-    if speaker_label:
-        content += dedent(
-            """\
-            <h2>{speaker_label}</h2>
-            {speakers}
-            """
-        ).format(**locals())
+    content = session_content(session, speaker_label, speakers)
     return render_page(path=path, title=f"{session.data.session_name}", content=content)
 
 
+INDEX_TEMPLATE = dedent(
+    """
+    <h1>{title}</h1>
+    <ul>
+    {items}
+    </ul>
+    """
+)
+
+
 def index_page(path: str, title: str, links: list[str]) -> str:
     items = "\n".join(f"<li>{link}</li>" for link in sorted(links))
-    content = dedent(
-        """
-        <h1>{title}</h1>
-        <ul>
-        {items}
-        </ul>
-        """
-    ).format(**locals())
+    content = INDEX_TEMPLATE.format(title=title, items=items)
     return render_page(path, title, content)
 
 
 def schedule_page(path: str, title: str, base_url: str, database: Database) -> str:
+    # Sorting the sessions up front means the days, times and links below are
+    # all inserted in order, and keeps the output stable between runs.
+    sessions = sorted(
+        database.sessions.values(),
+        key=lambda s: (
+            s.data.session_start_date_time.date(),
+            s.data.session_start_date_time.time(),
+            s.data.session_name,
+        ),
+    )
     days: dict[date, dict[time, list[str]]] = {}
-    for session in database.sessions.values():
+    for session in sessions:
         start = session.data.session_start_date_time
         times = days.setdefault(start.date(), {})
         links = times.setdefault(start.time(), [])
         links.append(session.link(base_url))
 
     lines = []
-    for date, times in sorted(days.items()):
+    for date, times in days.items():
         lines.append(f"<h2>{date:%A, %B %d, %Y}</h2>")
-        for time, links in sorted(times.items()):
+        for time, links in times.items():
             lines.append(f"<h3>{time:%I:%M %p}</h3>")
             lines.append(f"<ul>")
             for link in links:
@@ -178,9 +201,17 @@ async def manage_repo(repo_dir: Path, commit: bool) -> AsyncIterator[None]:
             proc = await create_subprocess_exec("zola", "build", cwd=repo_dir)
             if (returncode := await proc.wait()) != 0:
                 raise RuntimeError(f"'zola build' exited {returncode}")
-            proc = await create_subprocess_exec("git", "add", ".", cwd=repo_dir)
+            proc = await create_subprocess_exec("git", "add", "-A", cwd=repo_dir)
             if (returncode := await proc.wait()) != 0:
                 raise RuntimeError(f"'git add' exited {returncode}")
+            proc = await create_subprocess_exec(
+                "git", "diff", "--cached", "--quiet", cwd=repo_dir
+            )
+            if (returncode := await proc.wait()) == 0:
+                logger.info("No changes to commit")
+                return
+            elif returncode != 1:
+                raise RuntimeError(f"'git diff' exited {returncode}")
             proc = await create_subprocess_exec(
                 "git",
                 "commit",
@@ -200,49 +231,69 @@ async def generate_pages(
 ) -> None:
     async with manage_repo(repo_dir, commit):
         output_dir = repo_dir / "content/_generated"
-        if output_dir.is_dir():
-            shutil.rmtree(output_dir)
-        output_dir.mkdir()
+        output_dir.mkdir(exist_ok=True)
 
-        (output_dir / "schedule.md").write_text(
-            schedule_page(base_url + "schedule", "Schedule", base_url, database)
+        # Render everything first, then write all the files concurrently
+        pages: dict[Path, str] = {}
+        pages[output_dir / "schedule.md"] = schedule_page(
+            base_url + "schedule", "Schedule", base_url, database
         )
 
         links = []
         for session in database.sessions.values():
-            page = session_page(
-                base_url + session.url_relpath, session, base_url, database
-            )
             path = output_dir / f"session-{session.slugified_name}.md"
-            if path.exists():
+            if path in pages:
                 logger.warn("Overwriting duplicate session %s", session.slugified_name)
-            path.write_text(page)
+            pages[path] = session_page(
+                base_url + session.url_relpath, session, base_url, database
+            )
             links.append(session.link(base_url))
-        (output_dir / "sessions.md").write_text(
-            index_page(base_url + "sessions", "Sessions", links)
+        pages[output_dir / "sessions.md"] = index_page(
+            base_url + "sessions", "Sessions", links
         )
 
         composer_links = []
         performer_links = []
         for speaker in database.speakers.values():
-            page = speaker_page(
-                base_url + speaker.url_relpath, speaker, base_url, database
-            )
             path = output_dir / f"speaker-{speaker.slugified_name}.md"
-            if path.exists():
+            if path in pages:
                 logger.warn("Overwriting duplicate speaker %s", speaker.slugified_name)
-            path.write_text(page)
-            if SpeakerCategory.COMPOSER in database.speaker_categories.get(
-                speaker.stub, []
-            ):
+            pages[path] = speaker_page(
+                base_url + speaker.url_relpath, speaker, base_url, database
+            )
+            if SpeakerCategory.COMPOSER in speaker.categories:
                 composer_links.append(speaker.link(base_url))
-            if SpeakerCategory.PERFORMER in database.speaker_categories.get(
-                speaker.stub, []
-            ):
+            if SpeakerCategory.PERFORMER in speaker.categories:
                 performer_links.append(speaker.link(base_url))
-        (output_dir / "composers.md").write_text(
-            index_page(base_url + "composers", "Composers", composer_links)
+        pages[output_dir / "composers.md"] = index_page(
+            base_url + "composers", "Composers", composer_links
+        )
+        pages[output_dir / "performers.md"] = index_page(
+            base_url + "performers", "Performers", performer_links
         )
-        (output_dir / "performers.md").write_text(
-            index_page(base_url + "performers", "Performers", performer_links)
+
+        # Only touch files whose contents changed, and remove pages that no
+        # longer exist, so unchanged pages keep their mtimes
+        for path in output_dir.iterdir():
+            if path in pages:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            logger.info("Removed %s", path)
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(write_if_changed, path, page.encode())
+                for path, page in pages.items()
+            )
         )
+
+
+def write_if_changed(path: Path, content: bytes) -> None:
+    try:
+        if path.read_bytes() == content:
+            return
+    except FileNotFoundError:
+        pass
+    path.write_bytes(content)